@@ -1,24 +1,48 @@
-import subprocess
-import shutil
+import asyncio
+import hashlib
+import io
+import logging
+import re
+import tempfile
+import threading
 import time
+import uuid
 from pathlib import Path
 from tempfile import TemporaryDirectory
-import json # Added for JSON post storage
 import os
+import aiofiles
+import orjson
 from dotenv import load_dotenv
 
 from fastapi import FastAPI, Request, UploadFile, File, Form
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse, StreamingResponse
-from typing import List, Dict, Any, Tuple
-from pydantic import BaseModel
+from fastapi.staticfiles import StaticFiles
+from fastapi.responses import HTMLResponse, ORJSONResponse, RedirectResponse, Response
+from typing import List, Dict, Any, Optional, Tuple
+from pydantic import BaseModel, TypeAdapter
+from PIL import Image
 from datetime import datetime
 from google.cloud import storage # Re-import Google Cloud Storage
+from starlette.middleware.gzip import GZipMiddleware
 from starlette.middleware.sessions import SessionMiddleware
 
 # Load environment variables
 load_dotenv()
 
+# Debug output (e.g. the ffmpeg commands) is only shown with LOG_LEVEL=DEBUG.
+# Only this module's logger is configured; library logging is left alone.
+# getLevelName returns a number for known level names; anything else falls back to INFO
+LOG_LEVEL = (os.getenv("LOG_LEVEL") or "INFO").upper()
+_log_level = logging.getLevelName(LOG_LEVEL)
+logger = logging.getLogger(__name__)
+logger.setLevel(_log_level if isinstance(_log_level, int) else logging.INFO)
+_log_handler = logging.StreamHandler()
+_log_handler.setFormatter(logging.Formatter("%(levelname)s:%(name)s:%(message)s"))
+logger.addHandler(_log_handler)
+logger.propagate = False
+if not isinstance(_log_level, int):
+    logger.warning("Unknown LOG_LEVEL %r, using INFO", LOG_LEVEL)
+
 # --- GCS Configuration ---
 GCS_BUCKET_NAME = os.getenv("GCS_BUCKET_NAME", "blog-posts-gazerah")
 GCS_SERVICE_ACCOUNT_KEY_PATH = os.getenv("GCS_SERVICE_ACCOUNT_KEY_PATH", "../credentials.json")
@@ -44,11 +68,18 @@ else:
     
 bucket = storage_client.bucket(GCS_BUCKET_NAME)
 
-# Remove StaticFiles mount as we'll be serving from GCS
-# app.mount("/static", StaticFiles(directory="files"), name="static")
-
 # Setup Jinja2 templates
 templates = Jinja2Templates(directory="templates")
+# The Docker build compiles Tailwind and vendors htmx into static/; without it
+# (local dev) the pages fall back to the CDN scripts
+STATIC_DIR = Path("static")
+templates.env.globals["static_assets"] = (STATIC_DIR / "styles.css").exists()
+# The homepage loads its posts client-side from /api/posts, so it is rendered
+# once at startup and served as-is
+_HOMEPAGE_BYTES = templates.get_template("index.html").render().encode("utf-8")
+_HOMEPAGE_ETAG = f'W/"{hashlib.blake2b(_HOMEPAGE_BYTES, digest_size=8).hexdigest()}"'
+# The login form is static too; only a failed login re-renders it with an error
+_LOGIN_PAGE_BYTES = templates.get_template("admin/login.html").render().encode("utf-8")
 
 # --- Blog Post Storage ---
 # Store blog_posts.json in GCS for persistence across Cloud Run instances
@@ -66,28 +97,126 @@ class BlogPost(BaseModel):
     description: str
     media: List[MediaItem]
 
-def load_posts() -> List[BlogPost]:
-    """Load blog posts from GCS. Returns empty list if file doesn't exist."""
+# Compiled once so whole lists are validated and posts serialized in single pydantic-core calls
+POSTS_ADAPTER = TypeAdapter(List[BlogPost])
+POST_ADAPTER = TypeAdapter(BlogPost)
+
+# Parsed posts cached in memory, keyed on the GCS object generation so a
+# write from any instance invalidates it
+_POSTS_CACHE: Optional[Tuple[int, List[BlogPost]]] = None
+# When the cached generation was last confirmed against GCS (time.monotonic())
+_POSTS_CHECKED_AT: float = 0.0
+# Public reads trust the cache for this long before checking GCS again;
+# admin routes always check so they never edit a stale list
+POSTS_MAX_AGE = float(os.getenv("POSTS_MAX_AGE", "5"))
+# Lookup by id, derived from the cached posts
+_POSTS_BY_ID: Dict[int, BlogPost] = {}
+# Id for the next new post, stored alongside the posts so ids are never reused
+_NEXT_ID: int = 1
+# Ready-to-send JSON bodies for the API, rebuilt whenever the cache changes.
+# The full list is kept with its ETag in one tuple so a request never pairs one
+# version's body with another's ETag while a worker thread refreshes the cache.
+# GCS generations are unique per write, so they double as the posts ETag.
+_POSTS_JSON_BODY: Tuple[bytes, str] = (b"[]", 'W/"0"')
+_POST_JSON_BY_ID: Dict[int, bytes] = {}
+# load_posts/save_posts run in worker threads; one refresh or write at a time
+_POSTS_LOCK = threading.Lock()
+
+def _cache_posts(generation: int, posts: List[BlogPost], posts_json: List[bytes], next_id: int):
+    """Store posts and their pre-serialized JSON (one entry per post) in the module cache."""
+    global _POSTS_CACHE, _POSTS_CHECKED_AT, _POSTS_BY_ID, _NEXT_ID, _POSTS_JSON_BODY, _POST_JSON_BY_ID
+    _POSTS_CACHE = (generation, posts)
+    _POSTS_CHECKED_AT = time.monotonic()
+    _POSTS_BY_ID = {post.id: post for post in posts}
+    _NEXT_ID = next_id
+    _POSTS_JSON_BODY = (b"[" + b",".join(posts_json) + b"]", f'W/"{generation:x}"')
+    _POST_JSON_BY_ID = {post.id: post_json for post, post_json in zip(posts, posts_json)}
+
+def posts_cache_fresh(max_age: float) -> bool:
+    """True if the cached posts were confirmed against GCS less than max_age seconds ago."""
+    return _POSTS_CACHE is not None and time.monotonic() - _POSTS_CHECKED_AT < max_age
+
+def load_posts(max_age: float = 0) -> List[BlogPost]:
+    """Load blog posts from GCS. Returns empty list if file doesn't exist.
+
+    Only the object metadata is fetched while the cached generation is current,
+    and not even that if the cache was confirmed less than max_age seconds ago.
+    """
+    if posts_cache_fresh(max_age):
+        return list(_POSTS_CACHE[1])
     try:
-        blob = bucket.blob(GCS_POSTS_FILE)
-        if blob.exists():
-            json_data = blob.download_as_text()
-            data = json.loads(json_data)
-            print(f"📚 Loaded {len(data)} posts from GCS (gs://{GCS_BUCKET_NAME}/{GCS_POSTS_FILE})")
-            return [BlogPost(**post) for post in data]
-        else:
-            print(f"📝 No posts file found in GCS, starting fresh")
-            return []
+        with _POSTS_LOCK:
+            # Requests that queued on the lock reuse the refresh the first one just did
+            if posts_cache_fresh(max_age):
+                return list(_POSTS_CACHE[1])
+            return _load_posts_locked()
     except Exception as e:
         print(f"⚠️  Error loading posts from GCS: {e}")
         return []
 
-def save_posts(posts: List[BlogPost]):
-    """Save blog posts to GCS."""
+def load_posts_snapshot() -> Tuple[List[BlogPost], Dict[int, BlogPost], int]:
+    """Load posts for an admin edit: the list, an id lookup built from that same list, and the next id.
+
+    Unlike load_posts, a GCS error is raised rather than turned into an empty list,
+    so an edit can never save over the stored posts from a failed read.
+    """
+    with _POSTS_LOCK:
+        posts = _load_posts_locked()
+        next_id = _NEXT_ID
+    return posts, {post.id: post for post in posts}, next_id
+
+def _load_posts_locked() -> List[BlogPost]:
+    """Body of load_posts; the caller holds _POSTS_LOCK. GCS errors are raised."""
+    global _POSTS_CHECKED_AT
+    blob = bucket.get_blob(GCS_POSTS_FILE)
+    # A missing file is cached as generation 0 (GCS never uses it), so it gets
+    # the same max_age window as a real one
+    generation = blob.generation if blob is not None else 0
+    if _POSTS_CACHE is not None and _POSTS_CACHE[0] == generation:
+        _POSTS_CHECKED_AT = time.monotonic()
+        return list(_POSTS_CACHE[1])
+    if blob is None:
+        print(f"📝 No posts file found in GCS, starting fresh")
+        _cache_posts(0, [], [], 1)
+        return []
+    # The blob is pinned to the generation we just stat'ed
+    data = orjson.loads(blob.download_as_bytes())
+    if isinstance(data, list):
+        # Older files are a bare list of posts without a stored next_id
+        posts_data = data
+        next_id = max((post["id"] for post in posts_data), default=0) + 1
+    else:
+        posts_data = data["posts"]
+        next_id = data["next_id"]
+    posts = POSTS_ADAPTER.validate_python(posts_data)
+    _cache_posts(blob.generation, posts, [orjson.dumps(post) for post in posts_data], next_id)
+    print(f"📚 Loaded {len(posts_data)} posts from GCS (gs://{GCS_BUCKET_NAME}/{GCS_POSTS_FILE})")
+    return list(posts)
+
+def save_posts(posts: List[BlogPost], next_id: Optional[int] = None):
+    """Save blog posts to GCS and refresh the in-memory cache.
+
+    next_id defaults to the currently stored value; creating a post passes the bumped id.
+    GCS objects can only be replaced whole, so only the serialization is incremental:
+    posts that are still the cached objects reuse their JSON and only new or edited
+    posts are dumped.
+    """
+    with _POSTS_LOCK:
+        if next_id is None:
+            next_id = _NEXT_ID
+        _save_posts_locked(posts, next_id)
+
+def _save_posts_locked(posts: List[BlogPost], next_id: int):
+    """Body of save_posts; the caller holds _POSTS_LOCK."""
     try:
         blob = bucket.blob(GCS_POSTS_FILE)
-        json_data = json.dumps([post.model_dump() for post in posts], indent=4)
+        posts_json = [
+            _POST_JSON_BY_ID[post.id] if _POSTS_BY_ID.get(post.id) is post else POST_ADAPTER.dump_json(post)
+            for post in posts
+        ]
+        json_data = b'{"next_id":%d,"posts":[%s]}' % (next_id, b",".join(posts_json))
         blob.upload_from_string(json_data, content_type='application/json')
+        _cache_posts(blob.generation, list(posts), posts_json, next_id)
         print(f"💾 Saved {len(posts)} posts to GCS (gs://{GCS_BUCKET_NAME}/{GCS_POSTS_FILE})")
     except Exception as e:
         print(f"❌ Error saving posts to GCS: {e}")
@@ -99,9 +228,19 @@ app = FastAPI(title="My Simple Blog", description="A personal blog built with Fa
 # Add session middleware for authentication
 app.add_middleware(SessionMiddleware, secret_key=os.getenv("SECRET_KEY", "fallback-secret-key"))
 
+# Compress HTML and JSON responses for clients that accept gzip
+app.add_middleware(GZipMiddleware, minimum_size=512)
+
+# Built CSS/JS assets; uploaded media is served from GCS
+if STATIC_DIR.is_dir():
+    app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
+
 # Admin password from .env
 ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD", "admin")
 
+# Admin edits refuse to run on a failed read rather than save over the stored posts
+POSTS_UNAVAILABLE_MESSAGE = "Could not load posts from storage, please try again"
+
 @app.on_event("startup")
 async def startup_event():
     """Run startup checks and print configuration."""
@@ -119,6 +258,11 @@ async def startup_event():
     except Exception as e:
         print(f"⚠️  GCS connection issue: {e}")
     
+    # Pick the fastest H.264 encoder this host can actually run
+    global H264_ENCODER
+    H264_ENCODER = await detect_h264_encoder()
+    print(f"🎞️  Video encoder: {H264_ENCODER}")
+    
     # Load posts
     posts = load_posts()
     print(f"📚 Loaded {len(posts)} existing posts")
@@ -130,125 +274,459 @@ def get_gcs_url(object_name: str) -> str:
     """Generates a public URL for a GCS object."""
     return f"https://storage.googleapis.com/{GCS_BUCKET_NAME}/{object_name}"
 
+# Number of media objects under posts/ and when it was listed (time.monotonic()).
+# Other workers and instances upload and delete media too, so the count is
+# re-listed once it is MEDIA_COUNT_MAX_AGE seconds old rather than adjusted in
+# place; this process's own uploads and deletes drop it straight away
+MEDIA_COUNT_MAX_AGE = float(os.getenv("MEDIA_COUNT_MAX_AGE", "60"))
+_MEDIA_COUNT: Optional[Tuple[int, float]] = None
+# Bumped on every invalidation so a listing that was already running isn't cached
+_MEDIA_COUNT_VERSION = 0
+
+def invalidate_media_count():
+    """Drops the cached media count so it is listed from GCS again."""
+    global _MEDIA_COUNT, _MEDIA_COUNT_VERSION
+    _MEDIA_COUNT_VERSION += 1
+    _MEDIA_COUNT = None
+
 def upload_to_gcs(source_file_path: Path, destination_blob_name: str):
     """Uploads a file to the GCS bucket."""
     blob = bucket.blob(destination_blob_name)
     blob.upload_from_filename(source_file_path)
+    invalidate_media_count()
     print(f"File {source_file_path} uploaded to {destination_blob_name}.")
 
-def process_media(input_path: Path, quality: str, post_date_folder: str) -> Tuple[str, str]:
+def upload_bytes_to_gcs(data: bytes, destination_blob_name: str, content_type: str):
+    """Uploads in-memory data to the GCS bucket."""
+    blob = bucket.blob(destination_blob_name)
+    blob.upload_from_string(data, content_type=content_type)
+    invalidate_media_count()
+    print(f"{len(data)} bytes uploaded to {destination_blob_name}.")
+
+def count_gcs_media() -> int:
+    """Counts the media files stored under posts/ in the GCS bucket."""
+    global _MEDIA_COUNT
+    cached = _MEDIA_COUNT
+    if cached is not None and time.monotonic() - cached[1] < MEDIA_COUNT_MAX_AGE:
+        return cached[0]
+    version, listed_at = _MEDIA_COUNT_VERSION, time.monotonic()
+    count = sum(1 for blob in bucket.list_blobs(prefix="posts/") if not blob.name.endswith('/'))
+    if version == _MEDIA_COUNT_VERSION:
+        _MEDIA_COUNT = (count, listed_at)
+    return count
+
+# H.264 encoder for videos; set at startup by detect_h264_encoder
+H264_ENCODER = "libx264"
+
+# Hardware H.264 encoders in order of preference, each with the ffmpeg args that
+# open the device, the filter that hands frames to it and its rate-control flags
+# (the quality target is appended to the latter)
+HW_H264_ENCODERS = {
+    # -b:v 0 lifts ffmpeg's default 2 Mb/s target so -cq is true constant quality
+    'h264_nvenc': ([], ['-pix_fmt', 'yuv420p'], ['-preset', 'p1', '-rc', 'vbr', '-b:v', '0', '-cq']),
+    'h264_qsv': ([], ['-vf', 'format=nv12'], ['-preset', 'veryfast', '-global_quality']),
+    'h264_vaapi': (['-vaapi_device', '/dev/dri/renderD128'], ['-vf', 'format=nv12,hwupload'], ['-qp']),
+}
+
+async def detect_h264_encoder() -> str:
     """
-    Converts the input media file (video or image) for web optimization and uploads to GCS.
+    Returns the first hardware H.264 encoder that works on this host, or 'libx264'.
 
-    Args:
-        input_path: Path to the original media file.
-        quality: A string indicating the desired quality ('high', 'medium', 'low').
-        post_date_folder: The date folder (e.g., '24-06-2025') for GCS organization.
+    ffmpeg builds list hardware encoders even when the device is missing, so each
+    one is tried with a tiny test encode instead of only checking `ffmpeg -encoders`.
+    """
+    for encoder, (device_args, filter_args, _) in HW_H264_ENCODERS.items():
+        command = [
+            'ffmpeg', '-hide_banner', '-loglevel', 'error', *device_args,
+            '-f', 'lavfi', '-i', 'color=size=256x256:duration=0.1',
+            *filter_args, '-c:v', encoder, '-f', 'null', '-'
+        ]
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *command, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL
+            )
+        except FileNotFoundError:
+            break
+        if await proc.wait() == 0:
+            return encoder
+    return "libx264"
+
+# Bounds how many encodes (ffmpeg processes or Pillow image saves) run at once.
+# Half the cores, so a batch of uploads can't saturate the machine and stall
+# request handling
+ENCODE_MAX_CONCURRENCY = max(1, (os.cpu_count() or 2) // 2)
+_ENCODE_SEMAPHORE = asyncio.Semaphore(ENCODE_MAX_CONCURRENCY)
+# Split the cores between concurrent encodes; by default each ffmpeg starts a thread per core
+FFMPEG_THREADS = max(1, (os.cpu_count() or 2) // ENCODE_MAX_CONCURRENCY)
+# libx264 tuning: fastdecode keeps playback cheap for visitors; LOW_MEM=1 switches to
+# zerolatency, which drops the lookahead buffers and uses far less memory per encode
+X264_TUNE = 'zerolatency' if os.getenv("LOW_MEM") == "1" else 'fastdecode'
+
+# Uploads and conversions are staged in the system temp dir. Set SCRATCH_DIR=/dev/shm
+# to use tmpfs on hosts where it is large enough (Docker's default is only 64 MB)
+SCRATCH_DIR = Path(os.getenv("SCRATCH_DIR") or tempfile.gettempdir())
+
+# Converted files kept on local disk, keyed by a hash of the upload plus the
+# quality, so uploading the same file again skips the encode. The directory is
+# shared by every worker process (and outlives them), so the size limit is
+# enforced from a scan of the directory, with file mtimes as the LRU order.
+CONVERSION_CACHE_DIR = SCRATCH_DIR / "blog-conversion-cache"
+CONVERSION_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+# Cloud Run (which sets K_SERVICE) keeps the filesystem in instance memory, so the
+# cache is off there unless CONVERSION_CACHE_MAX_BYTES is set; 0 turns it off anywhere
+_DEFAULT_CONVERSION_CACHE_BYTES = 0 if os.getenv("K_SERVICE") else 64 * 1024 * 1024
+CONVERSION_CACHE_MAX_BYTES = int(os.getenv("CONVERSION_CACHE_MAX_BYTES", _DEFAULT_CONVERSION_CACHE_BYTES))
+
+def hash_file(path: Path) -> str:
+    """Returns a BLAKE2b digest of the file contents."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        while chunk := f.read(UPLOAD_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def write_cache_file(path: Path, data: bytes):
+    """Writes a conversion cache entry atomically, so other workers never read a partial file."""
+    with tempfile.NamedTemporaryFile(dir=CONVERSION_CACHE_DIR, delete=False) as f:
+        try:
+            f.write(data)
+        except BaseException:
+            os.unlink(f.name)
+            raise
+    try:
+        os.replace(f.name, path)
+    except BaseException:
+        # Eviction skips tmp* files, so a leftover one would never be cleaned up
+        os.unlink(f.name)
+        raise
 
-    Returns:
-        A tuple: (public GCS URL of the converted file, file_type_string)
+def remember_conversion(path: Path):
+    """Marks a cache entry as most recently used and evicts the oldest entries over the size limit.
+
+    Entries written by other workers or earlier processes are counted too. Another
+    worker may evict any entry at any time, so readers treat a missing file as a miss.
+    An entry bigger than the whole limit is evicted as well, once everything older is gone.
     """
-    ext = input_path.suffix.lower()
-    
-    # 1. Determine Conversion Parameters based on quality
-    crf_map = {'high': '20', 'medium': '23', 'low': '28'}
-    crf_value = crf_map.get(quality, '23')
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        return
+    entries = []
+    with os.scandir(CONVERSION_CACHE_DIR) as it:
+        for entry in it:
+            # Skip in-progress writes (tmp*) and per-encode working directories
+            if entry.name.startswith("tmp") or not entry.is_file():
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry_path in sorted(entries):
+        if total <= CONVERSION_CACHE_MAX_BYTES:
+            break
+        Path(entry_path).unlink(missing_ok=True)
+        total -= size
+
+def encode_image_webp(input_path: Path, quality: int) -> bytes:
+    """Encodes an image as WebP with Pillow. method=4 matches ffmpeg's -compression_level 4."""
+    with Image.open(input_path) as image:
+        buffer = io.BytesIO()
+        image.save(buffer, format='WEBP', quality=quality, method=4)
+    return buffer.getvalue()
+
+# First line of ffmpeg's stderr that mentions an error
+_ERR_RE = re.compile(r'^.*[Ee]rror[^\n]*', re.MULTILINE)
+
+# Upload extensions accepted for conversion
+_VIDEO_EXTS = frozenset({'.mp4', '.mov', '.avi', '.mkv', '.webm'})
+_IMAGE_EXTS = frozenset({'.jpg', '.jpeg', '.png', '.tiff', '.bmp', '.webp'})
+# Quality levels the encoders have settings for; anything else is encoded as 'medium'
+_QUALITY_LEVELS = frozenset({'high', 'medium', 'low'})
+
+def unique_suffix() -> str:
+    """Short random tag for GCS object names. Uploads often share a filename (iOS
+    sends every photo as image.jpg), and each one needs its own object."""
+    return uuid.uuid4().hex[:8]
+
+async def convert_image(input_path: Path, quality: str, digest: str, post_date_folder: str) -> Tuple[str, str]:
+    """Converts an image to WebP in-process with Pillow and uploads it to GCS."""
     webp_quality_map = {'high': '85', 'medium': '75', 'low': '60'}
     webp_quality = webp_quality_map.get(quality, '75')
 
-    # Use a temporary directory for the output file before uploading to GCS
-    with TemporaryDirectory() as output_temp_dir_str:
-        output_temp_dir = Path(output_temp_dir_str)
-        
-        if ext in ['.mp4', '.mov', '.avi', '.mkv', '.webm']:
-            # VIDEO CONVERSION (H.264/MP4)
-            optimized_filename = f"optimized_{input_path.stem}.mp4"
-            file_type = "Video (MP4)"
+    optimized_filename = f"optimized_{input_path.stem}_{unique_suffix()}.webp"
+    file_type = "Image (WebP)"
+    cache_path = CONVERSION_CACHE_DIR / f"{digest}_{quality}.webp"
+    webp_bytes = None
+    if CONVERSION_CACHE_MAX_BYTES:
+        try:
+            webp_bytes = await asyncio.to_thread(cache_path.read_bytes)
+        except FileNotFoundError:
+            pass
+    if webp_bytes is None:
+        async with _ENCODE_SEMAPHORE:
+            try:
+                webp_bytes = await asyncio.to_thread(encode_image_webp, input_path, int(webp_quality))
+            except Exception as e:
+                raise RuntimeError(f"Conversion failed for {input_path.name}. Detail: {e}")
+        # Always false while caching is off (limit 0)
+        if len(webp_bytes) <= CONVERSION_CACHE_MAX_BYTES:
+            await asyncio.to_thread(write_cache_file, cache_path, webp_bytes)
+    await asyncio.to_thread(remember_conversion, cache_path)
+
+    gcs_object_name = f"posts/{post_date_folder}/{optimized_filename}"
+    await asyncio.to_thread(upload_bytes_to_gcs, webp_bytes, gcs_object_name, 'image/webp')
+    return get_gcs_url(gcs_object_name), file_type
+
+async def probe_audio_codec(input_path: Path) -> Optional[str]:
+    """Returns the codec name of the first audio stream, or None if there is none or ffprobe fails."""
+    command = [
+        'ffprobe', '-v', 'error', '-select_streams', 'a:0',
+        '-show_entries', 'stream=codec_name', '-of', 'csv=p=0', os.fspath(input_path)
+    ]
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL
+        )
+    except FileNotFoundError:
+        return None
+    stdout, _ = await proc.communicate()
+    if proc.returncode != 0:
+        return None
+    return stdout.decode('ascii', 'replace').strip() or None
+
+async def convert_video(input_path: Path, quality: str, digest: str, post_date_folder: str) -> Tuple[str, str]:
+    """Converts a video to H.264/MP4 with ffmpeg and uploads it to GCS."""
+    crf_map = {'high': '20', 'medium': '23', 'low': '28'}
+    crf_value = crf_map.get(quality, '23')
+    preset_map = {'high': 'fast', 'medium': 'veryfast', 'low': 'ultrafast'}
+    preset_value = preset_map.get(quality, 'veryfast')
+    # Hardware encoders take a constant-quality target instead of a CRF
+    cq_map = {'high': '22', 'medium': '26', 'low': '30'}
+    cq_value = cq_map.get(quality, '26')
+
+    optimized_filename = f"optimized_{input_path.stem}_{unique_suffix()}.mp4"
+    file_type = "Video (MP4)"
+    cache_path = CONVERSION_CACHE_DIR / f"{digest}_{quality}.mp4"
+    # Work in a temporary directory next to the cache. A cached encode is hard-linked
+    # in, so another worker evicting it can't remove it before the upload reads it
+    with TemporaryDirectory(dir=CONVERSION_CACHE_DIR) as output_temp_dir:
+        # ffmpeg only needs path strings, so skip building Path objects here
+        optimized_output_path = os.path.join(output_temp_dir, optimized_filename)
+        cached = False
+        if CONVERSION_CACHE_MAX_BYTES:
+            try:
+                await asyncio.to_thread(os.link, cache_path, optimized_output_path)
+                cached = True
+            except FileNotFoundError:
+                pass
+
+        if not cached:
+            if H264_ENCODER == 'libx264':
+                input_args = []
+                # 4:2:0 output plays in every browser, whatever the source chroma format
+                codec_args = [
+                    '-vcodec', 'libx264', '-crf', crf_value, '-preset', preset_value,
+                    '-tune', X264_TUNE, '-pix_fmt', 'yuv420p'
+                ]
+            else:
+                # Decode on the GPU as well when it can; ffmpeg falls back to software otherwise
+                device_args, filter_args, quality_args = HW_H264_ENCODERS[H264_ENCODER]
+                input_args = ['-hwaccel', 'auto', *device_args]
+                codec_args = [*filter_args, '-c:v', H264_ENCODER, *quality_args, cq_value]
+            # Cap stream probing (bytes / microseconds) so ffmpeg starts encoding sooner
+            input_args += ['-probesize', '500000', '-analyzeduration', '500000']
+            # AAC audio (typical for phone MP4/MOV) goes into the MP4 as-is instead of being re-encoded
+            if await probe_audio_codec(input_path) == 'aac':
+                audio_args = ['-c:a', 'copy']
+            else:
+                audio_args = ['-acodec', 'aac']
+            # +faststart rewrites the file after encoding, so MP4 needs a seekable output file
             command = [
                 'ffmpeg',
-                '-i', str(input_path),
-                '-vcodec', 'libx264',
-                '-crf', crf_value,
-                '-preset', 'fast',
-                '-acodec', 'aac',
+                '-loglevel', 'error', '-nostats', # Only errors on stderr, no progress lines
+                *input_args,
+                '-i', os.fspath(input_path),
+                *codec_args,
+                '-threads', str(FFMPEG_THREADS),
+                *audio_args,
                 '-movflags', '+faststart', # Optimizes for web streaming
-                '-y', # Overwrite output files without asking
-                str(output_temp_dir / optimized_filename)
-            ]
-            
-        elif ext in ['.jpg', '.jpeg', '.png', '.tiff', '.bmp', '.webp']:
-            # IMAGE CONVERSION (WebP)
-            optimized_filename = f"optimized_{input_path.stem}.webp"
-            file_type = "Image (WebP)"
-            command = [
-                'ffmpeg',
-                '-i', str(input_path),
-                '-q:v', webp_quality, # WebP quality setting
-                '-compression_level', '4', # Balance between speed and size (0=fastest, 6=slowest/smallest)
-                '-y', 
-                str(output_temp_dir / optimized_filename)
+                optimized_output_path
             ]
-        else:
-            raise RuntimeError(f"Unsupported file type: {ext}. Only common video and image types are supported.")
 
-        optimized_output_path = output_temp_dir / optimized_filename
-    
-        print(f"Running command ({file_type}): {' '.join(command)}")
-        
-        try:
-            subprocess.run(command, check=True, capture_output=True, text=True)
-        except subprocess.CalledProcessError as e:
-            print(f"FFmpeg error for {input_path.name}: {e.stderr}")
-            error_detail = e.stderr.split('Error')[1].strip().split('\n')[0] if 'Error' in e.stderr else e.stderr.strip()
-            raise RuntimeError(f"Conversion failed for {input_path.name}. Detail: {error_detail}")
-        except FileNotFoundError:
-            raise RuntimeError("FFmpeg command not found. Please install ffmpeg on your server.")
-            
+            logger.debug("Running command (%s): %s", file_type, command)
+
+            async with _ENCODE_SEMAPHORE:
+                try:
+                    proc = await asyncio.create_subprocess_exec(
+                        *command, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE
+                    )
+                except FileNotFoundError:
+                    raise RuntimeError("FFmpeg command not found. Please install ffmpeg on your server.")
+                _, stderr_bytes = await proc.communicate()
+            if proc.returncode != 0:
+                stderr = stderr_bytes.decode('utf-8', 'replace')
+                print(f"FFmpeg error for {input_path.name}: {stderr}")
+                match = _ERR_RE.search(stderr)
+                # Capped so a long ffmpeg message doesn't end up in the response whole
+                error_detail = (match.group(0) if match else stderr).strip()[:200]
+                raise RuntimeError(f"Conversion failed for {input_path.name}. Detail: {error_detail}")
+            # Another worker may have cached the same encode meanwhile; either copy will do
+            if os.path.getsize(optimized_output_path) <= CONVERSION_CACHE_MAX_BYTES:
+                try:
+                    await asyncio.to_thread(os.link, optimized_output_path, cache_path)
+                except FileExistsError:
+                    pass
+        await asyncio.to_thread(remember_conversion, cache_path)
+
         # Upload the optimized file to GCS
         gcs_object_name = f"posts/{post_date_folder}/{optimized_filename}"
-        upload_to_gcs(optimized_output_path, gcs_object_name)
-        
-        return get_gcs_url(gcs_object_name), file_type
+        await asyncio.to_thread(upload_to_gcs, optimized_output_path, gcs_object_name)
+
+    return get_gcs_url(gcs_object_name), file_type
+
+# Conversion handler for each accepted upload extension
+_HANDLERS = {
+    **{ext: convert_video for ext in _VIDEO_EXTS},
+    **{ext: convert_image for ext in _IMAGE_EXTS},
+}
+
+async def process_media(input_path: Path, quality: str, post_date_folder: str) -> Tuple[str, str]:
+    """
+    Converts the input media file (video or image) for web optimization and uploads to GCS.
+
+    Args:
+        input_path: Path to the original media file.
+        quality: A string indicating the desired quality ('high', 'medium', 'low').
+        post_date_folder: The date folder (e.g., '24-06-2025') for GCS organization.
+
+    Returns:
+        A tuple: (public GCS URL of the converted file, file_type_string)
+    """
+    ext = input_path.suffix.lower()
+    handler = _HANDLERS.get(ext)
+    if handler is None:
+        raise RuntimeError(f"Unsupported file type: {ext}. Only common video and image types are supported.")
+
+    # The quality comes straight from the form and ends up in the cache filename
+    if quality not in _QUALITY_LEVELS:
+        quality = 'medium'
+
+    # Identical uploads at the same quality reuse the earlier conversion
+    digest = await asyncio.to_thread(hash_file, input_path)
+    return await handler(input_path, quality, digest, post_date_folder)
     
+# Uploads are copied to disk in 1 MiB chunks
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+async def save_upload(file: UploadFile, destination: Path):
+    """Streams an uploaded file to disk without blocking the event loop."""
+    async with aiofiles.open(destination, "wb") as buffer:
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            await buffer.write(chunk)
+
+async def process_uploads(files: List[UploadFile], quality: str, post_date_folder: str) -> List[MediaItem]:
+    """
+    Saves the uploaded files and converts them concurrently.
+
+    Files that fail to save or convert are logged and skipped. The returned
+    media items keep the upload order.
+    """
+    with TemporaryDirectory(dir=SCRATCH_DIR) as temp_dir_str:
+        temp_dir = Path(temp_dir_str)
+
+        # Each upload is staged in its own subdirectory: the saves run concurrently and
+        # several files can share a name (iOS sends every photo as image.jpg)
+        input_paths = []
+        for index, file in enumerate(files):
+            upload_dir = temp_dir / str(index)
+            upload_dir.mkdir()
+            input_paths.append(upload_dir / file.filename)
+        save_results = await asyncio.gather(
+            *[save_upload(file, path) for file, path in zip(files, input_paths)],
+            return_exceptions=True
+        )
+        saved_files = []
+        for file, path, result in zip(files, input_paths, save_results):
+            if isinstance(result, Exception):
+                print(f"Error processing {file.filename}: {result}")
+                continue
+            saved_files.append((file.filename, path))
+
+        results = await asyncio.gather(
+            *[process_media(path, quality, post_date_folder) for _, path in saved_files],
+            return_exceptions=True
+        )
+
+    media_items = []
+    for (filename, _), result in zip(saved_files, results):
+        if isinstance(result, Exception):
+            print(f"Error processing {filename}: {result}")
+            continue
+        gcs_url, file_type = result
+        media_type = "video" if "video" in file_type.lower() else "image"
+        media_items.append(MediaItem(type=media_type, url=gcs_url))
+    return media_items
+
+def cached_response(request: Request, body: bytes, media_type: str, etag: str) -> Response:
+    """Return the body with caching headers, or a 304 if the client's copy is current.
+
+    ETags are weak (W/"..."): GZipMiddleware sends the same tag on the gzip and
+    identity encodings, which a strong validator must not do. If-None-Match uses
+    weak comparison, so the W/ prefix is ignored on both sides.
+    """
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=60, must-revalidate"}
+    if_none_match = request.headers.get("if-none-match", "")
+    opaque_tag = etag.removeprefix("W/")
+    if opaque_tag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(",")):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type=media_type, headers=headers)
+
 @app.get("/", response_class=HTMLResponse)
 async def read_root(request: Request):
     """Serve the main blog page"""
-    posts = load_posts()
-    return templates.TemplateResponse("index.html", {"request": request, "posts": posts})
+    return cached_response(request, _HOMEPAGE_BYTES, "text/html", _HOMEPAGE_ETAG)
 
-@app.get("/api/posts", response_model=List[BlogPost])
-async def get_posts():
+@app.get("/api/posts")
+async def get_posts(request: Request):
     """API endpoint to get all blog posts"""
-    return load_posts()
+    if not posts_cache_fresh(POSTS_MAX_AGE):
+        await asyncio.to_thread(load_posts, POSTS_MAX_AGE)
+    body, etag = _POSTS_JSON_BODY
+    return cached_response(request, body, "application/json", etag)
 
-@app.get("/api/posts/{post_id}", response_model=BlogPost)
+@app.get("/api/posts/{post_id}")
 async def get_post(post_id: int):
     """API endpoint to get a specific blog post"""
-    posts = load_posts()
-    for post in posts:
-        if post.id == post_id:
-            return post
-    return {"error": "Post not found"}
-
-def delete_gcs_object(object_name: str):
-    """Deletes a single object from GCS bucket."""
-    try:
-        blob = bucket.blob(object_name)
-        blob.delete()
-        print(f"Deleted {object_name} from GCS")
-    except Exception as e:
-        print(f"Error deleting {object_name}: {e}")
+    if not posts_cache_fresh(POSTS_MAX_AGE):
+        await asyncio.to_thread(load_posts, POSTS_MAX_AGE)
+    post_json = _POST_JSON_BY_ID.get(post_id)
+    if post_json is None:
+        return ORJSONResponse({"error": "Post not found"}, status_code=404)
+    return Response(post_json, media_type="application/json")
 
 def delete_post_media(media_urls: List[str]):
-    """Deletes all media files for a post from GCS."""
+    """Deletes all media files for a post from GCS in a single batch request."""
+    object_names = []
     for url in media_urls:
         # Extract object name from URL
         # URL format: https://storage.googleapis.com/bucket-name/object-name
         try:
-            object_name = url.split(f"storage.googleapis.com/{GCS_BUCKET_NAME}/")[1]
-            delete_gcs_object(object_name)
+            object_names.append(url.split(f"storage.googleapis.com/{GCS_BUCKET_NAME}/")[1])
         except Exception as e:
-            print(f"Error parsing/deleting URL {url}: {e}")
+            print(f"Error parsing URL {url}: {e}")
+    if not object_names:
+        return
+
+    try:
+        with storage_client.batch():
+            bucket.delete_blobs(object_names)
+        print(f"Deleted {len(object_names)} objects from GCS")
+    except Exception as e:
+        print(f"Error deleting {object_names}: {e}")
+    # Some of the batch may have gone through even on error, so re-list either way
+    invalidate_media_count()
 
 def is_authenticated(request: Request) -> bool:
     """Check if user is authenticated"""
@@ -256,7 +734,6 @@ def is_authenticated(request: Request) -> bool:
 
 def require_auth(request: Request):
     """Require authentication, redirect to login if not authenticated"""
-    from fastapi.responses import RedirectResponse
     if not is_authenticated(request):
         return RedirectResponse(url="/admin/login")
     return None
@@ -265,12 +742,11 @@ def require_auth(request: Request):
 @app.get("/admin/login", response_class=HTMLResponse)
 async def admin_login_page(request: Request):
     """Admin login page"""
-    return templates.TemplateResponse("admin/login.html", {"request": request})
+    return HTMLResponse(_LOGIN_PAGE_BYTES)
 
 @app.post("/admin/login")
 async def admin_login(request: Request, password: str = Form(...)):
     """Handle admin login"""
-    from fastapi.responses import RedirectResponse
     if password == ADMIN_PASSWORD:
         request.session["admin_authenticated"] = True
         return RedirectResponse(url="/admin", status_code=303)
@@ -283,7 +759,6 @@ async def admin_login(request: Request, password: str = Form(...)):
 @app.get("/admin/logout")
 async def admin_logout(request: Request):
     """Logout admin"""
-    from fastapi.responses import RedirectResponse
     request.session.clear()
     return RedirectResponse(url="/")
 
@@ -295,9 +770,8 @@ async def admin_dashboard(request: Request):
     if auth_redirect:
         return auth_redirect
     
-    posts = load_posts()
-    # Count media files in GCS
-    media_count = sum(1 for blob in bucket.list_blobs(prefix="posts/") if not blob.name.endswith('/'))
+    posts = await asyncio.to_thread(load_posts)
+    media_count = await asyncio.to_thread(count_gcs_media)
     return templates.TemplateResponse("admin/dashboard.html", {
         "request": request,
         "posts": posts,
@@ -310,7 +784,6 @@ async def admin_posts_page(request: Request):
     auth_redirect = require_auth(request)
     if auth_redirect:
         return auth_redirect
-    from fastapi.responses import RedirectResponse
     return RedirectResponse(url="/admin")
 
 @app.get("/admin/posts/new", response_class=HTMLResponse)
@@ -338,33 +811,21 @@ async def admin_create_post(
     auth_redirect = require_auth(request)
     if auth_redirect:
         return auth_redirect
-    from fastapi.responses import RedirectResponse
     
     # Process uploaded media
     media_items = []
     if files and files[0].filename:  # Check if files were actually uploaded
-        with TemporaryDirectory() as temp_dir_str:
-            temp_dir = Path(temp_dir_str)
-            
-            for file in files:
-                try:
-                    input_file_path = temp_dir / file.filename
-                    with open(input_file_path, "wb") as buffer:
-                        shutil.copyfileobj(file.file, buffer)
-                    
-                    gcs_url, file_type = process_media(input_file_path, quality, date_folder)
-                    media_type = "video" if "video" in file_type.lower() else "image"
-                    media_items.append(MediaItem(type=media_type, url=gcs_url))
-                except Exception as e:
-                    print(f"Error processing {file.filename}: {e}")
-                    continue
+        media_items = await process_uploads(files, quality, date_folder)
     
     # Create the post
-    posts = load_posts()
-    next_id = max([p.id for p in posts]) + 1 if posts else 1
+    try:
+        posts, _, next_id = await asyncio.to_thread(load_posts_snapshot)
+    except Exception as e:
+        print(f"⚠️  Error loading posts from GCS: {e}")
+        return HTMLResponse(POSTS_UNAVAILABLE_MESSAGE, status_code=503)
     new_post = BlogPost(id=next_id, title=title, date=date, description=description, media=media_items)
     posts.append(new_post)
-    save_posts(posts)
+    await asyncio.to_thread(save_posts, posts, next_id + 1)
     
     return RedirectResponse(url="/admin", status_code=303)
 
@@ -373,8 +834,12 @@ async def admin_edit_post_page(post_id: int, request: Request):
     auth_redirect = require_auth(request)
     if auth_redirect:
         return auth_redirect
-    posts = load_posts()
-    post = next((p for p in posts if p.id == post_id), None)
+    try:
+        _, posts_by_id, _ = await asyncio.to_thread(load_posts_snapshot)
+    except Exception as e:
+        print(f"⚠️  Error loading posts from GCS: {e}")
+        return HTMLResponse(POSTS_UNAVAILABLE_MESSAGE, status_code=503)
+    post = posts_by_id.get(post_id)
     if not post:
         return HTMLResponse("Post not found", status_code=404)
     return templates.TemplateResponse("admin/edit_post.html", {
@@ -400,16 +865,17 @@ async def admin_update_post(
     auth_redirect = require_auth(request)
     if auth_redirect:
         return auth_redirect
-    from fastapi.responses import RedirectResponse
     
-    posts = load_posts()
-    post_index = next((i for i, p in enumerate(posts) if p.id == post_id), None)
+    try:
+        posts, posts_by_id, _ = await asyncio.to_thread(load_posts_snapshot)
+    except Exception as e:
+        print(f"⚠️  Error loading posts from GCS: {e}")
+        return HTMLResponse(POSTS_UNAVAILABLE_MESSAGE, status_code=503)
+    old_post = posts_by_id.get(post_id)
     
-    if post_index is None:
+    if old_post is None:
         return HTMLResponse("Post not found", status_code=404)
     
-    old_post = posts[post_index]
-    
     # Determine which media to delete (old media not in existing_media_urls)
     old_media_urls = [m.url for m in old_post.media]
     existing_media_urls = existing_media_urls or []
@@ -417,7 +883,7 @@ async def admin_update_post(
     
     # Delete removed media from GCS
     if media_to_delete:
-        delete_post_media(media_to_delete)
+        await asyncio.to_thread(delete_post_media, media_to_delete)
     
     # Keep existing media in the NEW ORDER from the form
     media_items = []
@@ -427,26 +893,12 @@ async def admin_update_post(
     
     # Process newly uploaded media (these go at the end)
     if files and files[0].filename:
-        with TemporaryDirectory() as temp_dir_str:
-            temp_dir = Path(temp_dir_str)
-            
-            for file in files:
-                try:
-                    input_file_path = temp_dir / file.filename
-                    with open(input_file_path, "wb") as buffer:
-                        shutil.copyfileobj(file.file, buffer)
-                    
-                    gcs_url, file_type = process_media(input_file_path, quality, date_folder)
-                    media_type = "video" if "video" in file_type.lower() else "image"
-                    media_items.append(MediaItem(type=media_type, url=gcs_url))
-                except Exception as e:
-                    print(f"Error processing {file.filename}: {e}")
-                    continue
+        media_items.extend(await process_uploads(files, quality, date_folder))
     
     # Update the post
     updated_post = BlogPost(id=post_id, title=title, date=date, description=description, media=media_items)
-    posts[post_index] = updated_post
-    save_posts(posts)
+    posts[posts.index(old_post)] = updated_post
+    await asyncio.to_thread(save_posts, posts)
     
     return RedirectResponse(url="/admin", status_code=303)
 
@@ -456,8 +908,12 @@ async def admin_delete_post(post_id: int, request: Request):
     auth_redirect = require_auth(request)
     if auth_redirect:
         return auth_redirect
-    posts = load_posts()
-    post = next((p for p in posts if p.id == post_id), None)
+    try:
+        posts, posts_by_id, _ = await asyncio.to_thread(load_posts_snapshot)
+    except Exception as e:
+        print(f"⚠️  Error loading posts from GCS: {e}")
+        return HTMLResponse(POSTS_UNAVAILABLE_MESSAGE, status_code=503)
+    post = posts_by_id.get(post_id)
     
     if not post:
         return HTMLResponse("Post not found", status_code=404)
@@ -465,14 +921,17 @@ async def admin_delete_post(post_id: int, request: Request):
     # Delete all media for this post from GCS
     media_urls = [m.url for m in post.media]
     if media_urls:
-        delete_post_media(media_urls)
+        await asyncio.to_thread(delete_post_media, media_urls)
     
     # Remove post from list
     posts = [p for p in posts if p.id != post_id]
-    save_posts(posts)
+    await asyncio.to_thread(save_posts, posts)
     
     return HTMLResponse(status_code=200)
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    # Multiple workers need the app as an import string; a single worker reuses this
+    # module instead of importing it again as "main"
+    uvicorn.run("main:app" if workers > 1 else app, host="0.0.0.0", port=8000, workers=workers)
\ No newline at end of file